@@ -4,63 +4,267 @@ Universal website downloader that creates a complete static copy of any website.
 This script crawls all pages within the same domain and downloads all assets.
 
 Usage:
-    python3 universal_site_downloader.py [URL] [OUTPUT_DIR] [--delay SECONDS]
+    python3 universal_site_downloader.py [URL] [OUTPUT_DIR] [--delay SECONDS] [--workers N] [--update]
     
 Examples:
     python3 universal_site_downloader.py https://example.com
     python3 universal_site_downloader.py https://example.com my_site_backup
     python3 universal_site_downloader.py https://example.com my_site_backup --delay 2
+    python3 universal_site_downloader.py https://example.com my_site_backup --workers 8
+    python3 universal_site_downloader.py https://example.com my_site_backup --update
+
+Requirements:
+    pip install requests lxml
+    pip install brotli  # optional, enables brotli-compressed responses
 """
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+import lxml.html
+from lxml import etree
 import os
 import re
 import time
 import sys
 import argparse
-from urllib.parse import urljoin, urlparse, unquote
+from urllib.parse import urljoin, urlparse, urlunparse, unquote, parse_qsl, urlencode
 from urllib.robotparser import RobotFileParser
 import mimetypes
 from pathlib import Path
 import hashlib
+import codecs
+import functools
+import sqlite3
+import shutil
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Chunk size used when streaming downloads to disk
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Ports dropped from URLs during canonicalization
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+# Number of assets downloaded in parallel
+ASSET_WORKERS = 8
+# Queued asset downloads allowed before the crawl waits for some to finish
+MAX_QUEUED_ASSETS = 8 * ASSET_WORKERS
+
+# ETag/Last-Modified cache kept in the output directory between runs
+CACHE_FILENAME = '.crawl_cache.db'
+
+_INVALID_CHARS = re.compile(r'[<>:"/\\|?*]')
+_UNDERSCORE_RUN = re.compile(r'_+')
+_NONALNUM_RE = re.compile(r'[^a-zA-Z0-9]')
+
+# url(...) references in stylesheets (bytes) and style attributes (str)
+_CSS_URL_RE = re.compile(rb'url\(\s*["\']?([^)"\']+)["\']?\s*\)')
+_STYLE_URL_RE = re.compile(r'url\(\s*["\']?([^)"\']+)["\']?\s*\)')
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset', re.IGNORECASE)
+_HTML_START_RE = re.compile(rb'(\xef\xbb\xbf)?\s*<(!doctype\s+html|html)', re.IGNORECASE)
+
+# Content types that are clearly not documents; anything else (including the
+# octet-stream types often sent for extensionless pages) is parsed as HTML
+NON_DOCUMENT_TYPES = (
+    'image/', 'font/', 'audio/', 'video/', 'text/css', 'text/javascript',
+    'application/javascript', 'application/pdf', 'application/zip', 'application/font',
+)
+
+# Precompiled XPath queries; attribute queries return plain strings
+_PAGE_LINK_XPATH = etree.XPath(
+    '//a/@href | //link[not(contains(@rel, "stylesheet"))]/@href', smart_strings=False
+)
+_ASSET_XPATH = etree.XPath(
+    '//img/@src | //link[contains(@rel, "stylesheet")]/@href | //script/@src'
+    ' | //video/@src | //audio/@src | //source/@src',
+    smart_strings=False
+)
+_STYLE_XPATH = etree.XPath('//@style', smart_strings=False)
+_REWRITE_XPATH = etree.XPath('//a[@href] | //link[@href] | //img[@src] | //script[@src]')
+
+@functools.lru_cache(maxsize=65536)
+def _sanitize_filename(filename):
+    """Sanitize filename for filesystem compatibility (memoized)"""
+    # Replace invalid characters with underscores
+    filename = _INVALID_CHARS.sub('_', filename)
+    # Remove multiple consecutive underscores and clean up
+    filename = _UNDERSCORE_RUN.sub('_', filename)
+    filename = filename.strip('. _')
+    return filename[:255]  # Limit length
+
+def _temp_path(path):
+    """Temporary sibling of path, unique to the calling thread
+    
+    The name has a fixed length, so it stays valid for targets that are
+    already at the filesystem's 255-character limit.
+    """
+    name_hash = hashlib.sha1(path.name.encode('utf-8', errors='surrogateescape')).hexdigest()[:16]
+    return path.with_name(f'.{name_hash}.{threading.get_ident()}.tmp')
+
+def _write_bytes(path, data):
+    """Write a small file with raw os calls, bypassing Python's buffered I/O
+    
+    The data goes to a temporary file that then replaces path, so files
+    hard-linked to path are never modified.
+    """
+    tmp_path = _temp_path(path)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+@functools.lru_cache(maxsize=256)
+def _parser_encoding(charset):
+    """Map a declared charset to a name lxml accepts, or None if unusable"""
+    try:
+        # Python's canonical name covers aliases lxml doesn't know (latin_1)
+        candidates = (charset, codecs.lookup(charset).name)
+    except LookupError:
+        return None
+    for candidate in candidates:
+        try:
+            lxml.html.HTMLParser(encoding=candidate)
+            return candidate
+        except LookupError:
+            continue
+    return None
+
+@functools.lru_cache(maxsize=1024)
+def _guess_content_type(extension):
+    """Guess a MIME type from a file extension (memoized)"""
+    return mimetypes.guess_type(f'file{extension}')[0] or ''
+
+@functools.lru_cache(maxsize=65536)
+def _compute_local_path(output_dir, url_path):
+    """Map a URL path to a file path under output_dir (memoized)"""
+    path = unquote(url_path)
+    
+    if path == '' or path == '/':
+        return Path(output_dir) / 'index.html'
+    
+    # Remove leading slash
+    path = path.lstrip('/')
+    
+    # If path ends with /, treat as directory and add index.html
+    if path.endswith('/'):
+        path += 'index.html'
+    elif '.' not in Path(path).name:
+        # If no extension, assume it's a page and add .html
+        path += '.html'
+    
+    # Sanitize each part of the path
+    parts = [_sanitize_filename(part) for part in path.split('/')]
+    return Path(output_dir) / Path(*parts)
+
 class WebsiteDownloader:
-    def __init__(self, base_url, output_dir, delay=1):
+    def __init__(self, base_url, output_dir, delay=1, workers=4):
         self.base_url = base_url.rstrip('/')
-        self.domain = urlparse(base_url).netloc
+        self.domain = urlparse(self.canonicalize_url(base_url)).netloc
         self.output_dir = Path(output_dir)
         self.delay = delay
+        self.workers = max(1, workers)
         self.session = requests.Session()
         self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Connection': 'keep-alive',
+            # Every encoding urllib3 can decode here (adds br if brotli is installed)
+            'Accept-Encoding': make_headers(accept_encoding=True)['accept-encoding']
         })
         
+        # Keep enough pooled connections open for all workers so TCP/TLS
+        # connections are reused, and retry transient server errors
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retries)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
         # Track downloaded URLs and files
         self.downloaded_urls = set()
         self.downloaded_files = set()
-        self.url_queue = deque([base_url])
+        start_url = self.canonicalize_url(base_url)
+        self.url_queue = deque([start_url])
+        # Mirrors url_queue for O(1) membership tests
+        self.queued_urls = {start_url}
         self.failed_urls = set()
         
+        # Pages currently being fetched or processed
+        self.in_progress = set()
+        # Earliest time the next page request may start, shared by all
+        # fetchers so the delay bounds the overall request rate
+        self.next_request_time = 0.0
+        self.rate_lock = threading.Lock()
+        # Assets currently being downloaded by the asset pool
+        self.pending_files = set()
+        # Local files already written or validated during this run
+        self.saved_paths = set()
+        # Local files currently being downloaded
+        self.pending_paths = set()
+        # First file saved for each content hash, used to hard-link duplicates
+        self.content_hashes = {}
+        # Directories known to exist, so mkdir is only called once per directory
+        self.known_dirs = set()
+        self.lock = threading.Lock()
+        self.asset_pool = ThreadPoolExecutor(max_workers=ASSET_WORKERS)
+        # Asset downloads submitted to the pool and not yet finished
+        self.asset_futures = set()
+        
         # Create output directory
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
+        # Open the conditional-GET cache (shared by all worker threads).
+        # Autocommit keeps stored validators if the crawl is interrupted;
+        # WAL with synchronous=NORMAL keeps those per-row commits cheap.
+        self.cache = sqlite3.connect(str(self.output_dir / CACHE_FILENAME),
+                                     check_same_thread=False, isolation_level=None)
+        self.cache.execute('PRAGMA journal_mode=WAL')
+        self.cache.execute('PRAGMA synchronous=NORMAL')
+        self.cache.execute(
+            'CREATE TABLE IF NOT EXISTS urls '
+            '(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, sha TEXT)'
+        )
+        self.cache_lock = threading.Lock()
+        
         # Check robots.txt
+        self.robots_cache = {}
         self.check_robots_txt()
     
     def check_robots_txt(self):
         """Check robots.txt for crawling permissions"""
         try:
             robots_url = f"{self.base_url}/robots.txt"
-            rp = RobotFileParser()
-            rp.set_url(robots_url)
-            rp.read()
+            rp = RobotFileParser(robots_url)
+            # Fetch through the pooled session (same headers and keep-alive
+            # connection as the crawl), mirroring RobotFileParser.read()
+            try:
+                response = self.session.get(robots_url, timeout=10)
+            except requests.exceptions.RetryError:
+                # Server errors persisted through the retries
+                response = None
+            
+            if response is None or response.status_code in (401, 403) or response.status_code >= 500:
+                # Unreachable or forbidden robots.txt: crawl nothing (RFC 9309)
+                rp.disallow_all = True
+            elif response.status_code >= 400:
+                # No robots.txt: everything is allowed
+                rp.allow_all = True
+            else:
+                rp.parse(response.content.decode('utf-8', errors='replace').splitlines())
             self.robots_parser = rp
             logger.info("Robots.txt loaded successfully")
         except Exception as e:
@@ -70,39 +274,102 @@ class WebsiteDownloader:
     def can_fetch(self, url):
         """Check if we can fetch the URL according to robots.txt"""
         if self.robots_parser:
-            return self.robots_parser.can_fetch('*', url)
+            allowed = self.robots_cache.get(url)
+            if allowed is None:
+                allowed = self.robots_cache[url] = self.robots_parser.can_fetch('*', url)
+            return allowed
         return True
     
+    def canonicalize_url(self, url):
+        """Normalize a URL so that equivalent spellings are only fetched once"""
+        parsed = urlparse(url)
+        scheme = parsed.scheme.lower()
+        
+        # Lowercase the host and drop the scheme's default port
+        netloc = parsed.netloc.lower()
+        default_port = DEFAULT_PORTS.get(scheme)
+        if default_port and netloc.endswith(f':{default_port}'):
+            netloc = netloc[:-len(default_port) - 1]
+        
+        # Strip trailing slashes, keeping the root path
+        path = parsed.path.rstrip('/') or '/'
+        
+        # Sort query parameters and drop the fragment
+        query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+        return urlunparse((scheme, netloc, path, parsed.params, query, ''))
+    
     def sanitize_filename(self, filename):
         """Sanitize filename for filesystem compatibility"""
-        # Replace invalid characters with underscores
-        filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
-        # Remove multiple consecutive underscores and clean up
-        filename = re.sub(r'_+', '_', filename)
-        filename = filename.strip('. _')
-        return filename[:255]  # Limit length
+        return _sanitize_filename(filename)
     
     def get_local_path(self, url):
         """Convert URL to local file path"""
-        parsed = urlparse(url)
-        path = unquote(parsed.path)
-        
-        if path == '' or path == '/':
-            return self.output_dir / 'index.html'
-        
-        # Remove leading slash
-        path = path.lstrip('/')
+        return _compute_local_path(str(self.output_dir), urlparse(url).path)
+    
+    def get_conditional_headers(self, url, local_path):
+        """Build If-None-Match/If-Modified-Since headers from the cache"""
+        # Validators are only useful if we still have the file they describe
+        if not local_path.exists():
+            return {}
+        
+        with self.cache_lock:
+            row = self.cache.execute(
+                'SELECT etag, last_modified FROM urls WHERE url = ?', (url,)
+            ).fetchone()
+        
+        headers = {}
+        if row:
+            etag, last_modified = row
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+    
+    def update_cache(self, url, response, sha):
+        """Store the validators of a successful response in the cache"""
+        with self.cache_lock:
+            self.cache.execute(
+                'INSERT OR REPLACE INTO urls (url, etag, last_modified, sha) VALUES (?, ?, ?, ?)',
+                (url, response.headers.get('ETag'), response.headers.get('Last-Modified'), sha)
+            )
+    
+    def has_same_size_on_server(self, url, local_path):
+        """Compare the Content-Length from a HEAD request with the local file size"""
+        try:
+            # Ask for the identity encoding so Content-Length is the real size
+            response = self.session.head(url, timeout=10, allow_redirects=True,
+                                         headers={'Accept-Encoding': 'identity'})
+        except requests.RequestException:
+            return False
         
-        # If path ends with /, treat as directory and add index.html
-        if path.endswith('/'):
-            path += 'index.html'
-        elif '.' not in Path(path).name:
-            # If no extension, assume it's a page and add .html
-            path += '.html'
+        content_length = response.headers.get('Content-Length', '')
+        return (response.ok and content_length.isdigit()
+                and int(content_length) == local_path.stat().st_size)
+    
+    def ensure_dir(self, directory):
+        """Create a directory unless it is already known to exist"""
+        if directory not in self.known_dirs:
+            directory.mkdir(parents=True, exist_ok=True)
+            self.known_dirs.add(directory)
+    
+    def link_duplicate(self, local_path, digest):
+        """Replace a file with a hard link if identical content was already saved"""
+        with self.lock:
+            original = self.content_hashes.setdefault(digest, local_path)
+        if original == local_path:
+            return
         
-        # Sanitize each part of the path
-        parts = [self.sanitize_filename(part) for part in path.split('/')]
-        return self.output_dir / Path(*parts)
+        # Link to a temporary name first so the copy survives if linking fails
+        tmp_path = _temp_path(local_path)
+        try:
+            os.link(original, tmp_path)
+            os.replace(tmp_path, local_path)
+            logger.info(f"Linked duplicate: {local_path} -> {original}")
+        except OSError as e:
+            # Filesystem without hard links, keep the separate copy
+            logger.debug(f"Could not hard-link {local_path}: {e}")
+            tmp_path.unlink(missing_ok=True)
     
     def download_file(self, url, local_path):
         """Download a file from URL to local path"""
@@ -111,171 +378,312 @@ class WebsiteDownloader:
                 logger.warning(f"Robots.txt disallows fetching: {url}")
                 return False
             
-            response = self.session.get(url, timeout=30)
+            # Claim the local path: cache-busting variants of one file (e.g.
+            # a.png?v=1 and a.png?v=2) all map to it
+            with self.lock:
+                already_saved = local_path in self.saved_paths
+                claimed = not already_saved and local_path not in self.pending_paths
+                if claimed:
+                    self.pending_paths.add(local_path)
+            if not claimed:
+                # Another URL already saved it, or is saving it right now
+                if already_saved:
+                    self.download_local_css_assets(url, local_path)
+                return True
+            
+            try:
+                return self.save_file(url, local_path)
+            finally:
+                with self.lock:
+                    self.pending_paths.discard(local_path)
+            
+        except Exception as e:
+            logger.error(f"Failed to download {url}: {e}")
+            self.failed_urls.add(url)
+            return False
+    
+    def save_file(self, url, local_path):
+        """Fetch a claimed local path, revalidating or skipping it when possible"""
+        headers = self.get_conditional_headers(url, local_path)
+        if local_path.exists() and not headers and self.has_same_size_on_server(url, local_path):
+            # Left by a previous run without validators, same size on the server
+            logger.info(f"Already downloaded: {url}")
+            with self.lock:
+                self.saved_paths.add(local_path)
+            self.download_local_css_assets(url, local_path)
+            return True
+        
+        with self.session.get(url, timeout=30, stream=True, headers=headers) as response:
+            if response.status_code == 304:
+                # Unchanged since the last run, keep the existing file
+                logger.info(f"Not modified: {url}")
+                with self.lock:
+                    self.saved_paths.add(local_path)
+                self.download_local_css_assets(url, local_path)
+                return True
+            
             response.raise_for_status()
             
             # Create directory if it doesn't exist
-            local_path.parent.mkdir(parents=True, exist_ok=True)
+            self.ensure_dir(local_path.parent)
+            
+            # Fall back to the URL's extension if the server sends no type
+            content_type = response.headers.get('content-type', '').lower()
+            if not content_type:
+                content_type = _guess_content_type(os.path.splitext(urlparse(url).path)[1].lower())
             
             # Write file
-            if 'text' in response.headers.get('content-type', '').lower():
-                with open(local_path, 'w', encoding='utf-8', errors='ignore') as f:
-                    f.write(response.text)
+            if 'text' in content_type:
+                # Hash the bytes actually written: the same raw body decodes
+                # differently under different declared charsets
+                data = response.text.encode('utf-8', errors='ignore')
+                sha = hashlib.sha256(data)
+                _write_bytes(local_path, data)
+                is_css = 'css' in content_type or urlparse(url).path.endswith('.css')
             else:
-                with open(local_path, 'wb') as f:
-                    f.write(response.content)
-            
-            logger.info(f"Downloaded: {url} -> {local_path}")
-            return True
+                # Stream binary files to disk in chunks instead of
+                # holding the whole body in memory. Like _write_bytes, go
+                # through a temporary file so hard-linked twins are untouched.
+                sha = hashlib.sha256()
+                tmp_path = _temp_path(local_path)
+                try:
+                    with open(tmp_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                            sha.update(chunk)
+                            f.write(chunk)
+                    os.replace(tmp_path, local_path)
+                except BaseException:
+                    tmp_path.unlink(missing_ok=True)
+                    raise
+                is_css = False
             
-        except Exception as e:
-            logger.error(f"Failed to download {url}: {e}")
-            self.failed_urls.add(url)
-            return False
+            self.update_cache(url, response, sha.hexdigest())
+        
+        self.link_duplicate(local_path, sha.hexdigest())
+        with self.lock:
+            self.saved_paths.add(local_path)
+        logger.info(f"Downloaded: {url} -> {local_path}")
+        
+        if is_css:
+            self.download_css_assets(url, response.content)
+        return True
+    
+    def claim_assets(self, asset_urls):
+        """Mark assets as pending and return those no one has fetched yet"""
+        with self.lock:
+            new_assets = set(asset_urls) - self.downloaded_files - self.pending_files
+            self.pending_files.update(new_assets)
+        return new_assets
     
-    def extract_links(self, soup, base_url):
-        """Extract all links from HTML soup"""
+    def fetch_asset(self, asset_url):
+        """Download a claimed asset and record the outcome"""
+        try:
+            success = self.download_file(asset_url, self.get_local_path(asset_url))
+        finally:
+            with self.lock:
+                self.pending_files.discard(asset_url)
+        if success:
+            with self.lock:
+                self.downloaded_files.add(asset_url)
+    
+    def download_css_assets(self, css_url, content):
+        """Download fonts and images referenced by url(...) in a stylesheet"""
+        asset_urls = set()
+        for match in _CSS_URL_RE.finditer(content):
+            asset_url = urljoin(css_url, match.group(1).decode('utf-8', errors='ignore').strip())
+            # Skip data: URIs and other non-HTTP references
+            if urlparse(asset_url).scheme in ('http', 'https'):
+                asset_urls.add(self.canonicalize_url(asset_url))
+        
+        # Fetched on the current thread: it may already be an asset pool
+        # worker, and waiting on the pool from inside it could deadlock
+        for asset_url in self.claim_assets(asset_urls):
+            self.fetch_asset(asset_url)
+    
+    def download_local_css_assets(self, url, local_path):
+        """Download url(...) references of a stylesheet kept from disk"""
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        if 'css' in _guess_content_type(extension) and local_path.exists():
+            self.download_css_assets(url, local_path.read_bytes())
+    
+    def extract_links(self, document, base_url):
+        """Extract all page links from a parsed HTML document"""
         links = set()
         
-        # Extract page links
-        for tag in soup.find_all(['a', 'link'], href=True):
-            href = tag['href']
-            full_url = urljoin(base_url, href)
-            parsed = urlparse(full_url)
+        # Stylesheets are assets, everything else linked is a candidate page
+        for href in _PAGE_LINK_XPATH(document):
+            full_url = self.canonicalize_url(urljoin(base_url, href))
             
             # Only include links from the same domain
-            if parsed.netloc == self.domain:
-                # Remove fragment
-                clean_url = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
-                if parsed.query:
-                    clean_url += f"?{parsed.query}"
-                links.add(clean_url)
+            if urlparse(full_url).netloc == self.domain:
+                links.add(full_url)
         
         return links
     
-    def extract_assets(self, soup, base_url):
-        """Extract all asset URLs from HTML soup"""
-        assets = set()
-        
-        # Images
-        for img in soup.find_all('img', src=True):
-            assets.add(urljoin(base_url, img['src']))
-        
-        # CSS files
-        for link in soup.find_all('link', rel='stylesheet', href=True):
-            assets.add(urljoin(base_url, link['href']))
-        
-        # JavaScript files
-        for script in soup.find_all('script', src=True):
-            assets.add(urljoin(base_url, script['src']))
-        
-        # Other assets (videos, audio, etc.)
-        for tag in soup.find_all(['video', 'audio', 'source'], src=True):
-            assets.add(urljoin(base_url, tag['src']))
+    def extract_assets(self, document, base_url):
+        """Extract all asset URLs from a parsed HTML document"""
+        # Images, stylesheets, scripts and media sources
+        assets = {urljoin(base_url, src) for src in _ASSET_XPATH(document)}
         
         # Background images in style attributes
-        for tag in soup.find_all(style=True):
-            style = tag['style']
-            urls = re.findall(r'url\(["\']?([^"\']+)["\']?\)', style)
-            for url in urls:
-                assets.add(urljoin(base_url, url))
-        
-        return assets
-    
-    def update_links_in_html(self, soup, original_url):
-        """Update links in HTML to point to local files"""
-        base_path = self.get_local_path(original_url).parent
-        
-        # Update page links
-        for tag in soup.find_all(['a', 'link'], href=True):
-            href = tag['href']
-            full_url = urljoin(original_url, href)
-            parsed = urlparse(full_url)
-            
-            if parsed.netloc == self.domain:
-                local_path = self.get_local_path(full_url)
-                try:
-                    rel_path = os.path.relpath(local_path, base_path)
-                    tag['href'] = rel_path
-                except ValueError:
-                    # Can't create relative path, use absolute
-                    tag['href'] = str(local_path)
-        
-        # Update asset links
-        for img in soup.find_all('img', src=True):
-            src = img['src']
-            full_url = urljoin(original_url, src)
-            if urlparse(full_url).netloc == self.domain:
-                local_path = self.get_local_path(full_url)
-                try:
-                    rel_path = os.path.relpath(local_path, base_path)
-                    img['src'] = rel_path
-                except ValueError:
-                    img['src'] = str(local_path)
-        
-        # Update CSS links
-        for link in soup.find_all('link', rel='stylesheet', href=True):
-            href = link['href']
-            full_url = urljoin(original_url, href)
-            if urlparse(full_url).netloc == self.domain:
-                local_path = self.get_local_path(full_url)
-                try:
-                    rel_path = os.path.relpath(local_path, base_path)
-                    link['href'] = rel_path
-                except ValueError:
-                    link['href'] = str(local_path)
-        
-        # Update script sources
-        for script in soup.find_all('script', src=True):
-            src = script['src']
-            full_url = urljoin(original_url, src)
-            if urlparse(full_url).netloc == self.domain:
-                local_path = self.get_local_path(full_url)
-                try:
-                    rel_path = os.path.relpath(local_path, base_path)
-                    script['src'] = rel_path
-                except ValueError:
-                    script['src'] = str(local_path)
-    
-    def process_html_page(self, url):
-        """Process an HTML page: download it and extract links"""
-        if url in self.downloaded_urls:
-            return
+        for style in _STYLE_XPATH(document):
+            for url in _STYLE_URL_RE.findall(style):
+                asset_url = urljoin(base_url, url)
+                # Skip inline data: URIs and other non-HTTP schemes
+                if urlparse(asset_url).scheme in ('http', 'https'):
+                    assets.add(asset_url)
+        
+        return {self.canonicalize_url(asset_url) for asset_url in assets}
+    
+    def update_links_in_html(self, document, original_url, base_url=None):
+        """Update links in HTML to point to local files
         
+        Relative links are resolved against base_url (the final URL after
+        redirects) when given, otherwise against original_url.
+        """
+        base_url = base_url or original_url
+        base_path = self.get_local_path(self.canonicalize_url(original_url)).parent
+        # Relative paths already computed for this page, keyed by URL
+        rel_cache = {}
+        
+        # Single pass over page links, stylesheets, images and scripts
+        for tag in _REWRITE_XPATH(document):
+            attr = 'href' if tag.tag in ('a', 'link') else 'src'
+            full_url = self.canonicalize_url(urljoin(base_url, tag.get(attr)))
+            if full_url in rel_cache:
+                tag.set(attr, rel_cache[full_url])
+                continue
+            if urlparse(full_url).netloc != self.domain:
+                continue
+            local_path = self.get_local_path(full_url)
+            try:
+                rel_path = os.path.relpath(local_path, base_path)
+            except ValueError:
+                # Can't create relative path, use absolute
+                rel_path = str(local_path)
+            rel_cache[full_url] = rel_path
+            tag.set(attr, rel_path)
+    
+    def page_encoding(self, response):
+        """Pick the encoding to parse an HTML response with"""
+        # Trust a charset declared by the server, if it is a real one
+        if 'charset=' in response.headers.get('content-type', '').lower():
+            return _parser_encoding(response.encoding) or 'utf-8'
+        # Let lxml honour a <meta charset> declaration
+        if _META_CHARSET_RE.search(response.content[:1024]):
+            return None
+        # Otherwise assume UTF-8 rather than lxml's ISO-8859-1 default
+        return 'utf-8'
+    
+    def fetch_page(self, url):
+        """Fetch stage: download a page's HTML (runs on a fetcher thread)"""
         try:
             if not self.can_fetch(url):
                 logger.warning(f"Robots.txt disallows fetching: {url}")
-                return
+                return None
             
-            logger.info(f"Processing HTML page: {url}")
+            # Be respectful - reserve the next request slot across all
+            # fetchers, then sleep until it outside the lock. Waiting before
+            # the request rather than after it hands the response to the
+            # parser without delay.
+            if self.delay > 0:
+                with self.rate_lock:
+                    slot = max(time.monotonic(), self.next_request_time)
+                    self.next_request_time = slot + self.delay
+                remaining = slot - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+            
+            logger.info(f"Fetching HTML page: {url}")
             response = self.session.get(url, timeout=30)
             response.raise_for_status()
+            return response
             
-            soup = BeautifulSoup(response.content, 'html.parser')
+        except Exception as e:
+            logger.error(f"Failed to fetch HTML page {url}: {e}")
+            self.failed_urls.add(url)
+            return None
+    
+    def set_meta_charset(self, document, encoding):
+        """Make the page declare encoding in a <meta charset> tag
+        
+        libxml2 drops <meta http-equiv="Content-Type"> when serializing, so
+        pages that declare their charset that way would otherwise lose it.
+        """
+        metas = document.xpath('//meta[@charset]')
+        if metas:
+            metas[0].set('charset', encoding)
+            return
+        
+        head = document.find('head')
+        if head is None:
+            head = lxml.html.Element('head')
+            document.insert(0, head)
+        head.insert(0, lxml.html.Element('meta', charset=encoding))
+    
+    def process_html_page(self, url, response):
+        """Process stage: parse a fetched page, queue its links and assets, save it"""
+        try:
+            local_path = self.get_local_path(url)
+            
+            # Links such as <link rel="icon"> can point at non-HTML files:
+            # save those as-is rather than re-serializing them as HTML,
+            # unless the body plainly starts like an HTML document. Empty
+            # bodies have nothing to parse either.
+            content_type = response.headers.get('content-type', '').lower()
+            is_other_type = (content_type.startswith(NON_DOCUMENT_TYPES)
+                             and not _HTML_START_RE.match(response.content[:1024]))
+            if is_other_type or not response.content.strip():
+                self.ensure_dir(local_path.parent)
+                _write_bytes(local_path, response.content)
+                self.downloaded_urls.add(url)
+                logger.info(f"Saved without parsing: {url} -> {local_path}")
+                return
+            
+            logger.info(f"Processing HTML page: {url}")
+            
+            # Parse with lxml directly: one C-level parse serves link
+            # extraction, link rewriting and serialization
+            parser = lxml.html.HTMLParser(encoding=self.page_encoding(response))
+            document = lxml.html.document_fromstring(response.content, parser=parser)
             
             # Extract and queue new page links
-            page_links = self.extract_links(soup, url)
+            # Resolve relative links against the final URL after redirects,
+            # which may differ from the canonical one (e.g. trailing slash)
+            page_links = self.extract_links(document, response.url)
             for link in page_links:
-                if link not in self.downloaded_urls and link not in self.url_queue:
+                if (link not in self.downloaded_urls and link not in self.in_progress
+                        and link not in self.queued_urls):
                     self.url_queue.append(link)
+                    self.queued_urls.add(link)
+            
+            # Hand assets to the asset pool; they download in the background
+            # while the crawl moves on to the next page
+            assets = self.extract_assets(document, response.url)
+            for asset_url in self.claim_assets(assets):
+                self.asset_futures.add(self.asset_pool.submit(self.fetch_asset, asset_url))
             
-            # Extract and download assets
-            assets = self.extract_assets(soup, url)
-            for asset_url in assets:
-                if asset_url not in self.downloaded_files:
-                    asset_path = self.get_local_path(asset_url)
-                    if self.download_file(asset_url, asset_path):
-                        self.downloaded_files.add(asset_url)
+            # Keep the backlog bounded: wait for downloads once too many are queued
+            self.asset_futures = {future for future in self.asset_futures if not future.done()}
+            while len(self.asset_futures) > MAX_QUEUED_ASSETS:
+                _, self.asset_futures = wait(self.asset_futures, return_when=FIRST_COMPLETED)
             
             # Update links to point to local files
-            self.update_links_in_html(soup, url)
+            self.update_links_in_html(document, url, response.url)
             
             # Save the updated HTML
-            local_path = self.get_local_path(url)
-            local_path.parent.mkdir(parents=True, exist_ok=True)
+            self.ensure_dir(local_path.parent)
             
-            with open(local_path, 'w', encoding='utf-8') as f:
-                f.write(str(soup))
+            # Serialize in the encoding the page was parsed with and declare
+            # it in the page; keep only a real doctype
+            docinfo = document.getroottree().docinfo
+            encoding = docinfo.encoding or 'utf-8'
+            self.set_meta_charset(document, encoding)
+            has_doctype = b'<!doctype' in response.content[:1024].lower()
+            _write_bytes(local_path, lxml.html.tostring(
+                document, encoding=encoding,
+                doctype=docinfo.doctype if has_doctype else None
+            ))
             
             self.downloaded_urls.add(url)
             logger.info(f"Saved HTML page: {local_path}")
@@ -285,21 +693,50 @@ class WebsiteDownloader:
             self.failed_urls.add(url)
     
     def download_website(self):
-        """Main method to download the entire website"""
+        """Main method to download the entire website
+        
+        Pages go through a two-stage pipeline: fetcher threads download up
+        to `workers` pages ahead, while this thread parses, saves and
+        extracts links from each response as it arrives.
+        """
         logger.info(f"Starting download of {self.base_url}")
         logger.info(f"Output directory: {self.output_dir}")
+        logger.info(f"Fetching up to {self.workers} pages ahead")
         
-        while self.url_queue:
-            url = self.url_queue.popleft()
-            
-            if url in self.downloaded_urls:
-                continue
-            
-            self.process_html_page(url)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as fetch_pool:
+                pending = {}
+                while self.url_queue or pending:
+                    # Keep up to `workers` page fetches in flight
+                    while self.url_queue and len(pending) < self.workers:
+                        url = self.url_queue.popleft()
+                        self.queued_urls.discard(url)
+                        if url in self.downloaded_urls or url in self.in_progress:
+                            continue
+                        self.in_progress.add(url)
+                        pending[fetch_pool.submit(self.fetch_page, url)] = url
+                    
+                    if not pending:
+                        continue
+                    
+                    # Parse whichever pages have arrived while the rest download
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        url = pending.pop(future)
+                        response = future.result()
+                        if response is not None:
+                            self.process_html_page(url, response)
+                        self.in_progress.discard(url)
             
-            # Be respectful - add delay between requests
-            if self.delay > 0:
-                time.sleep(self.delay)
+            self.asset_pool.shutdown()
+        finally:
+            # On interrupt, drop queued asset downloads and only wait for
+            # the ones already running
+            self.asset_pool.shutdown(cancel_futures=True)
+            # Persist the cache even if the crawl is interrupted
+            with self.cache_lock:
+                self.cache.commit()
+                self.cache.close()
         
         # Summary
         logger.info(f"Download complete!")
@@ -351,9 +788,9 @@ def generate_output_dir(url):
     parsed = urlparse(url)
     domain = parsed.netloc.replace('www.', '')
     # Replace all special characters with underscores for directory names
-    safe_domain = re.sub(r'[^a-zA-Z0-9]', '_', domain)
+    safe_domain = _NONALNUM_RE.sub('_', domain)
     # Remove multiple consecutive underscores and trailing underscores
-    safe_domain = re.sub(r'_+', '_', safe_domain).strip('_')
+    safe_domain = _UNDERSCORE_RUN.sub('_', safe_domain).strip('_')
     return safe_domain
 
 def main():
@@ -365,6 +802,8 @@ Examples:
   %(prog)s https://example.com
   %(prog)s https://example.com my_backup
   %(prog)s https://example.com my_backup --delay 2
+  %(prog)s https://example.com my_backup --workers 8
+  %(prog)s https://example.com my_backup --update
   %(prog)s --interactive
         """
     )
@@ -372,7 +811,11 @@ Examples:
     parser.add_argument('url', nargs='?', help='Website URL to download')
     parser.add_argument('output_dir', nargs='?', help='Output directory (default: auto-generated from URL)')
     parser.add_argument('--delay', type=float, default=1.0, 
-                       help='Delay between requests in seconds (default: 1.0)')
+                       help='Delay between page requests in seconds, shared by all workers (default: 1.0)')
+    parser.add_argument('--workers', type=int, default=4,
+                       help='Number of pages downloaded in parallel (default: 4)')
+    parser.add_argument('--update', action='store_true',
+                       help='Update an existing output directory in place, skipping unchanged assets')
     parser.add_argument('--interactive', '-i', action='store_true',
                        help='Interactive mode - prompt for URL and settings')
     
@@ -391,7 +834,7 @@ Examples:
         output_dir = output_input if output_input else default_output
         
         # Ask for delay
-        delay_input = input(f"\nDelay between requests in seconds (default: 1.0): ").strip()
+        delay_input = input(f"\nDelay between page requests in seconds (default: 1.0): ").strip()
         try:
             delay = float(delay_input) if delay_input else 1.0
         except ValueError:
@@ -408,27 +851,29 @@ Examples:
         output_dir = args.output_dir if args.output_dir else generate_output_dir(url)
         delay = args.delay
     
+    workers = args.workers
+    
     # Confirm settings
     print(f"\n=== Download Settings ===")
     print(f"URL: {url}")
     print(f"Output directory: {output_dir}")
     print(f"Delay between requests: {delay} seconds")
+    print(f"Parallel workers: {workers}")
     
     # Check if output directory exists
-    if os.path.exists(output_dir):
+    if os.path.exists(output_dir) and not args.update:
         response = input(f"\nOutput directory '{output_dir}' already exists. Overwrite? (y/N): ").strip().lower()
         if response not in ['y', 'yes']:
             print("Download cancelled.")
             sys.exit(0)
         
         # Remove existing directory
-        import shutil
         shutil.rmtree(output_dir)
     
     print(f"\nStarting download...")
     
     try:
-        downloader = WebsiteDownloader(url, output_dir, delay)
+        downloader = WebsiteDownloader(url, output_dir, delay, workers)
         downloader.download_website()
         
         print(f"\n=== Download Complete! ===")